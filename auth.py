@@ -56,8 +56,7 @@ async def main():
         # Сохранение сессии
         session_string = client.session.save()
         session_file = session_dir / "session.session"
-        with open(session_file, 'wb') as f:
-            f.write(session_string.encode('utf-8'))
+        session_file.write_text(session_string, encoding='utf-8')
         logger.info(f"Сессия сохранена в {session_file}")
 
         await client.disconnect()
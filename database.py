@@ -1,18 +1,23 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, select
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index, select, event, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Set, AsyncIterator
 from loguru import logger
+import asyncio
 import os
-import traceback
-import json
+import orjson
+from contextlib import asynccontextmanager
 
 Base = declarative_base()
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index("ix_msg_proc_id", "is_processed", "message_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     message_id = Column(Integer, unique=True)
@@ -20,7 +25,7 @@ class Message(Base):
     user_id = Column(Integer)
     text = Column(String)
     date = Column(DateTime)
-    is_processed = Column(Boolean, default=False)
+    is_processed = Column(Boolean, default=False, index=True)
     wiki_page = Column(String, nullable=True)
     analysis = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -42,13 +47,109 @@ class MediaFile(Base):
 
 Message.media_files = relationship("MediaFile", back_populates="message")
 
+class AnalysisCache(Base):
+    __tablename__ = 'analysis_cache'
+
+    text_hash = Column('hash', String, primary_key=True)
+    analysis = Column('json', String, nullable=False)
+
+def _message_upsert():
+    """Запрос пакетной записи сообщений: существующие строки обновляются по message_id"""
+    stmt = sqlite_insert(Message.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=[Message.message_id],
+        set_={
+            "is_processed": stmt.excluded.is_processed,
+            "wiki_page": stmt.excluded.wiki_page,
+            "analysis": stmt.excluded.analysis
+        }
+    )
+
+# Запрос строится один раз и переиспользуется через кеш компиляции SQLAlchemy
+MESSAGE_UPSERT = _message_upsert()
+
+# Параметры SQLite, применяемые к каждому новому соединению
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Для соединений только на чтение режим журнала и синхронизации не меняются
+SQLITE_READ_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA busy_timeout=5000",
+)
+
+def _pragma_listener(pragmas):
+    """Создание обработчика, настраивающего PRAGMA для нового соединения SQLite"""
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+    return set_sqlite_pragmas
+
+def _create_missing_indexes(connection):
+    """Создание индексов, отсутствующих в существующих таблицах"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
 class Database:
     def __init__(self, db_path: str = "data/bot.db"):
         self.engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        event.listen(self.engine.sync_engine, "connect", _pragma_listener(SQLITE_PRAGMAS))
         self.async_session = sessionmaker(
             self.engine, class_=AsyncSession, expire_on_commit=False
         )
+        # Отдельные соединения только на чтение: в режиме WAL они не мешают записи
+        self.read_engine = create_async_engine(f"sqlite+aiosqlite:///file:{db_path}?mode=ro&uri=true")
+        event.listen(self.read_engine.sync_engine, "connect", _pragma_listener(SQLITE_READ_PRAGMAS))
+        self.read_session = sessionmaker(
+            self.read_engine, class_=AsyncSession, expire_on_commit=False
+        )
         self.db_path = db_path
+        # Единая сессия записи на всё время работы бота; все записи сериализуются блокировкой
+        self._session: Optional[AsyncSession] = None
+        self._write_lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def _session_scope(self, session: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+        """Выдача сессии записи под блокировкой: переданной явно или общей
+
+        Блокировка берется и для явно переданной сессии, чтобы все фиксации
+        изменений выполнялись по очереди. Транзакцией переданной сессии
+        управляет вызывающий код.
+        """
+        async with self._write_lock:
+            if session is not None:
+                yield session
+                return
+            if self._session is None:
+                self._session = self.async_session()
+            try:
+                yield self._session
+                # Завершаем транзакцию чтения, чтобы не удерживать снимок WAL
+                if self._session.in_transaction():
+                    await self._session.commit()
+            except Exception:
+                await self._session.rollback()
+                raise
+
+    @asynccontextmanager
+    async def _read_scope(self, session: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+        """Выдача сессии чтения: переданной явно или новой на соединении только на чтение"""
+        if session is not None:
+            yield session
+            return
+        async with self.read_session() as read_session:
+            yield read_session
 
     async def setup(self) -> bool:
         """Инициализация базы данных"""
@@ -61,49 +162,74 @@ class Database:
             # Создаем таблицы
             async with self.engine.begin() as conn:
                 await conn.run_sync(Base.metadata.create_all)
+                # create_all не добавляет индексы в уже существующие таблицы
+                await conn.run_sync(_create_missing_indexes)
+            
+            # Открываем общую сессию
+            self._session = self.async_session()
             
             logger.info("База данных успешно инициализирована")
             return True
             
         except Exception as e:
-            logger.error(f"Ошибка при инициализации базы данных: {str(e)}")
-            logger.error(f"Тип ошибки: {type(e).__name__}")
-            logger.error(f"Трассировка:\n{traceback.format_exc()}")
+            logger.exception(f"Ошибка при инициализации базы данных: {str(e)}")
             return False
 
-    async def add_message(self, message_id: int, chat_id: int, user_id: int, text: str, date: datetime, analysis: Optional[Dict[str, Any]] = None) -> Optional[Message]:
+    async def add_message(self, message_id: int, chat_id: int, user_id: int, text: str, date: datetime, analysis: Optional[Dict[str, Any]] = None, session: Optional[AsyncSession] = None) -> Optional[Message]:
         """Добавление нового сообщения"""
         try:
-            async with self.async_session() as session:
-                # Проверяем, существует ли сообщение
-                result = await session.execute(
-                    select(Message).filter_by(message_id=message_id)
+            async with self._session_scope(session) as session:
+                # Вставка и проверка существования одним запросом
+                stmt = (
+                    sqlite_insert(Message)
+                    .values(
+                        message_id=message_id,
+                        chat_id=chat_id,
+                        user_id=user_id,
+                        text=text,
+                        date=date,
+                        analysis=orjson.dumps(analysis).decode() if analysis else None
+                    )
+                    .on_conflict_do_nothing(index_elements=["message_id"])
+                    .returning(Message)
                 )
-                existing_message = result.scalar_one_or_none()
+                result = await session.execute(stmt)
+                message = result.scalar_one_or_none()
+                await session.commit()
                 
-                if existing_message:
+                if message is None:
                     logger.info(f"Сообщение {message_id} уже существует в базе данных")
-                    return existing_message
-                
-                message = Message(
-                    message_id=message_id,
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    text=text,
-                    date=date,
-                    analysis=json.dumps(analysis) if analysis else None
-                )
-                session.add(message)
-                await session.commit()
+                    result = await session.execute(
+                        select(Message).filter_by(message_id=message_id)
+                    )
+                    message = result.scalar_one_or_none()
                 return message
         except Exception as e:
             logger.error(f"Ошибка при добавлении сообщения: {e}")
             return None
 
-    async def add_media_file(self, message_id: int, file_id: str, file_name: str, file_type: str) -> Optional[MediaFile]:
+    async def bulk_insert_messages(self, rows: List[Dict[str, Any]]) -> int:
+        """Пакетное добавление сообщений одной транзакцией через SQLAlchemy Core
+
+        Уже сохраненные сообщения (например, с is_processed=False после неудачной
+        правки или из обработчика новых сообщений) обновляются, а не пропускаются.
+        """
+        if not rows:
+            return 0
+        try:
+            # Core-запрос без ORM-инструментирования; блокировка общая с сессией
+            async with self._write_lock:
+                async with self.engine.begin() as conn:
+                    result = await conn.execute(MESSAGE_UPSERT, rows)
+                    return result.rowcount
+        except Exception as e:
+            logger.error(f"Ошибка при пакетном добавлении сообщений: {e}")
+            return 0
+
+    async def add_media_file(self, message_id: int, file_id: str, file_name: str, file_type: str, session: Optional[AsyncSession] = None) -> Optional[MediaFile]:
         """Добавление нового медиафайла"""
         try:
-            async with self.async_session() as session:
+            async with self._session_scope(session) as session:
                 media_file = MediaFile(
                     message_id=message_id,
                     file_id=file_id,
@@ -117,22 +243,22 @@ class Database:
             logger.error(f"Ошибка при добавлении медиафайла: {e}")
             return None
 
-    async def get_unprocessed_messages(self) -> List[Message]:
-        """Получение необработанных сообщений"""
+    async def iter_unprocessed(self, session: Optional[AsyncSession] = None) -> AsyncIterator[Message]:
+        """Потоковое получение необработанных сообщений"""
         try:
-            async with self.async_session() as session:
-                result = await session.execute(
+            async with self._read_scope(session) as session:
+                result = await session.stream_scalars(
                     select(Message).filter_by(is_processed=False)
                 )
-                return result.scalars().all()
+                async for message in result:
+                    yield message
         except Exception as e:
             logger.error(f"Ошибка при получении необработанных сообщений: {e}")
-            return []
 
-    async def mark_message_as_processed(self, message_id: int, wiki_page: str) -> bool:
+    async def mark_message_as_processed(self, message_id: int, wiki_page: str, session: Optional[AsyncSession] = None) -> bool:
         """Отметка сообщения как обработанного"""
         try:
-            async with self.async_session() as session:
+            async with self._session_scope(session) as session:
                 result = await session.execute(
                     select(Message).filter_by(message_id=message_id)
                 )
@@ -147,19 +273,52 @@ class Database:
             logger.error(f"Ошибка при отметке сообщения как обработанного: {e}")
             return False
 
-    async def get_processed_messages(self) -> list[int]:
-        """Получение списка ID обработанных сообщений"""
+    async def get_processed_messages(self, session: Optional[AsyncSession] = None) -> Set[int]:
+        """Получение множества ID обработанных сообщений"""
         try:
-            async with self.async_session() as session:
+            async with self._read_scope(session) as session:
                 result = await session.execute(
                     select(Message.message_id)
-                    .where(Message.is_processed == True)
+                    .where(Message.is_processed.is_(True))
                 )
-                return [row[0] for row in result]
+                return set(result.scalars())
         except Exception as e:
             logger.error(f"Ошибка при получении списка обработанных сообщений: {str(e)}")
-            return []
+            return set()
+
+    async def get_cached_analysis(self, text_hash: str, session: Optional[AsyncSession] = None) -> Optional[Dict[str, Any]]:
+        """Получение сохраненного анализа текста по его хешу"""
+        try:
+            async with self._read_scope(session) as session:
+                result = await session.execute(
+                    select(AnalysisCache.analysis)
+                    .where(AnalysisCache.text_hash == text_hash)
+                )
+                cached = result.scalar_one_or_none()
+                return orjson.loads(cached) if cached else None
+        except Exception as e:
+            logger.error(f"Ошибка при получении анализа из кеша: {e}")
+            return None
+
+    async def cache_analysis(self, text_hash: str, analysis: Dict[str, Any], session: Optional[AsyncSession] = None) -> bool:
+        """Сохранение анализа текста в кеш"""
+        try:
+            async with self._session_scope(session) as session:
+                await session.execute(
+                    insert(AnalysisCache)
+                    .values(text_hash=text_hash, analysis=orjson.dumps(analysis).decode())
+                    .prefix_with("OR IGNORE")
+                )
+                await session.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении анализа в кеш: {e}")
+            return False
 
     async def close(self):
         """Закрытие соединения с базой данных"""
-        await self.engine.dispose() 
\ No newline at end of file
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        await self.engine.dispose()
+        await self.read_engine.dispose() 
\ No newline at end of file
@@ -1,26 +1,71 @@
 import asyncio
 import os
-import traceback
+import sys
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
 
 from dotenv import load_dotenv
 from loguru import logger
+import orjson
 from telethon import TelegramClient, events
 from telethon.sessions import StringSession
 from telethon.tl.types import PeerChannel
 
 from database import Database
-from wiki_client import WikiClient
-from ollama_client import OllamaClient
+from wiki_client import WikiClient, WikiEditQueue
+from ollama_client import OllamaClient, create_session
 
 # Настройка логирования
+logger.remove()
+logger.add(sys.stderr, level="INFO")
 logger.add("logs/bot.log", rotation="1 day", retention="7 days", level="INFO")
 
 # Загрузка переменных окружения
 load_dotenv()
 
+# Максимальное число одновременных запросов к Ollama; сервер обычно обрабатывает
+# лишь несколько запросов параллельно (OLLAMA_NUM_PARALLEL), остальные ждут в его очереди
+OLLAMA_CONCURRENCY = 2
+# Количество исторических сообщений, анализируемых одним запросом к Ollama
+OLLAMA_BATCH_SIZE = 10
+# Размер порции исторических сообщений, сохраняемой в БД одной транзакцией
+HISTORY_PAGE_SIZE = 100
+
+# Шаблон содержимого страницы MediaWiki для одного сообщения
+CONTENT_TEMPLATE = (
+    "## {title}\n\n{text}\n\n"
+    "### Метаданные\n"
+    "- Дата: {date}\n"
+    "- Автор: {author}\n"
+    "- ID сообщения: {mid}\n"
+)
+
+# Файл сессии Telegram, создаваемый auth.py
+SESSION_PATH = Path("session/session.session")
+
+# Разобранная сессия Telegram, переиспользуется при повторном вызове setup()
+_session_cache: Optional[StringSession] = None
+
+def load_session(session_path: Path) -> StringSession:
+    """Загрузка сессии Telegram из файла (файл читается и разбирается один раз)"""
+    global _session_cache
+    if _session_cache is not None:
+        return _session_cache
+    
+    if not session_path.exists():
+        logger.error("Файл сессии не найден")
+        raise ValueError("Файл сессии не найден")
+    
+    session_string = session_path.read_text(encoding='utf-8').strip()
+    if not session_string:
+        logger.error("Файл сессии пуст")
+        raise ValueError("Файл сессии пуст")
+    
+    _session_cache = StringSession(session_string)
+    return _session_cache
+
 def get_env_int(key: str, default: Optional[int] = None) -> Optional[int]:
     """Безопасное получение целочисленного значения из переменных окружения"""
     value = os.getenv(key)
@@ -33,20 +78,74 @@ def get_env_int(key: str, default: Optional[int] = None) -> Optional[int]:
         logger.error(f"Невозможно преобразовать значение {value} для {key} в число")
         return default
 
+def get_env_str(key: str) -> Optional[str]:
+    """Получение строкового значения из переменных окружения"""
+    value = os.getenv(key)
+    if not value or value.startswith('your_'):
+        logger.warning(f"Переменная окружения {key} не установлена или содержит placeholder значение")
+        return None
+    return value
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Конфигурация бота, загружаемая из переменных окружения один раз"""
+    api_id: int
+    api_hash: str
+    phone: str
+    admin_id: int
+    group_id: int
+    wiki_username: str
+    wiki_password: str
+    wiki_site: str
+    ollama_url: str
+    ollama_model: str
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        """Загрузка и проверка конфигурации из переменных окружения"""
+        values = {
+            'api_id': get_env_int('TELEGRAM_API_ID'),
+            'api_hash': get_env_str('TELEGRAM_API_HASH'),
+            'phone': get_env_str('TELEGRAM_PHONE'),
+            'admin_id': get_env_int('ADMIN_ID'),
+            'group_id': get_env_int('GROUP_ID'),
+            'wiki_username': get_env_str('WIKI_USERNAME'),
+            'wiki_password': get_env_str('WIKI_PASSWORD'),
+            'wiki_site': get_env_str('WIKI_SITE'),
+            'ollama_url': get_env_str('OLLAMA_URL'),
+            'ollama_model': get_env_str('OLLAMA_MODEL'),
+        }
+        missing = [name for name, value in values.items() if value is None]
+        if missing:
+            raise ValueError(f"Не все обязательные переменные установлены: {', '.join(missing)}")
+        return cls(**values)
+
 class TelegramUserClient:
-    def __init__(self):
-        self.api_id = int(os.getenv('TELEGRAM_API_ID'))
-        self.api_hash = os.getenv('TELEGRAM_API_HASH')
-        self.phone = os.getenv('TELEGRAM_PHONE')
-        self.admin_id = int(os.getenv('ADMIN_ID'))
-        self.group_id = int(os.getenv('GROUP_ID'))
+    def __init__(self, cfg: Optional[Config] = None):
+        self.cfg = cfg or Config.from_env()
+        # Пир группы строится один раз; после подключения заменяется на InputPeer
+        self.group_peer = PeerChannel(self.cfg.group_id)
         self.client = None
         self.bot = None
         self.db = None
+        # Общий пул HTTP-соединений для MediaWiki и Ollama
+        self.http_session = None
         self.wiki_client = None
+        self.wiki_queue = None
         self.ollama_client = None
+        self.analysis_semaphore = asyncio.Semaphore(OLLAMA_CONCURRENCY)
         self.logger = logger
 
+    async def analyze_text_limited(self, text: str):
+        """Анализ текста с ограничением числа параллельных запросов к Ollama"""
+        async with self.analysis_semaphore:
+            return await self.ollama_client.analyze_text(text)
+
+    async def analyze_batch_limited(self, texts: list):
+        """Пакетный анализ текстов с ограничением числа параллельных запросов к Ollama"""
+        async with self.analysis_semaphore:
+            return await self.ollama_client.analyze_batch(texts)
+
     async def setup(self):
         """Настройка клиента"""
         self.logger.info("=== Начало инициализации клиента ===")
@@ -59,43 +158,29 @@ class TelegramUserClient:
         
         # Шаг 2: Загрузка конфигурации
         self.logger.info("Шаг 2: Загрузка конфигурации...")
-        self.logger.info(f"TELEGRAM_API_ID: {self.api_id}")
+        self.logger.info(f"TELEGRAM_API_ID: {self.cfg.api_id}")
         self.logger.info("TELEGRAM_API_HASH: ✓")
         self.logger.info("TELEGRAM_PHONE: ✓")
-        self.logger.info(f"ADMIN_ID: {self.admin_id}")
-        self.logger.info(f"GROUP_ID: {self.group_id}")
+        self.logger.info(f"ADMIN_ID: {self.cfg.admin_id}")
+        self.logger.info(f"GROUP_ID: {self.cfg.group_id}")
         self.logger.info("WIKI_USERNAME: ✓")
         self.logger.info("WIKI_PASSWORD: ✓")
         self.logger.info("WIKI_SITE: ✓")
         self.logger.info("OLLAMA_URL: ✓")
         self.logger.info("OLLAMA_MODEL: ✓")
         
-        # Шаг 3: Проверка обязательных переменных
+        # Шаг 3: Проверка обязательных переменных (выполнена в Config.from_env)
         self.logger.info("Шаг 3: Проверка обязательных переменных...")
-        if not all([self.api_id, self.api_hash, self.phone, self.admin_id, self.group_id]):
-            raise ValueError("Не все обязательные переменные установлены")
         self.logger.info("✓ Все обязательные переменные установлены")
         
         # Шаг 4: Инициализация клиента Telegram
         self.logger.info("Шаг 4: Инициализация клиента Telegram...")
         
-        # Проверяем наличие файла сессии
-        session_path = Path("session/session.session")
-        if not session_path.exists():
-            self.logger.error("Файл сессии не найден")
-            raise ValueError("Файл сессии не найден")
-        
         try:
-            # Читаем строку сессии из файла
-            session_string = session_path.read_text().strip()
-            if not session_string:
-                self.logger.error("Файл сессии пуст")
-                raise ValueError("Файл сессии пуст")
-            
             self.client = TelegramClient(
-                StringSession(session_string),
-                self.api_id,
-                self.api_hash
+                load_session(SESSION_PATH),
+                self.cfg.api_id,
+                self.cfg.api_hash
             )
             
             await self.client.connect()
@@ -109,7 +194,9 @@ class TelegramUserClient:
             
             # Проверка подключения к группе
             try:
-                group = await self.client.get_entity(PeerChannel(self.group_id))
+                group = await self.client.get_entity(self.group_peer)
+                # Сохраняем InputPeer, чтобы не запрашивать access_hash при каждом вызове
+                self.group_peer = await self.client.get_input_entity(group)
                 self.logger.info(f"✓ Успешно подключен к супергруппе: {group.title} (ID: {group.id})")
             except Exception as e:
                 self.logger.error(f"Ошибка при подключении к группе: {str(e)}")
@@ -121,27 +208,30 @@ class TelegramUserClient:
             self.logger.error(f"Ошибка при инициализации клиента Telegram: {str(e)}")
             raise
         
-        # Шаг 5: Инициализация клиента MediaWiki
-        self.logger.info("Шаг 5: Инициализация клиента MediaWiki...")
-        self.wiki_client = WikiClient()
-        await self.wiki_client.setup(
-            username=os.getenv('WIKI_USERNAME'),
-            password=os.getenv('WIKI_PASSWORD'),
-            wiki_url=os.getenv('WIKI_SITE')
-        )
-        self.logger.info("✓ Клиент MediaWiki успешно инициализирован")
-        
-        # Шаг 6: Инициализация клиента Ollama
-        self.logger.info("Шаг 6: Инициализация клиента Ollama...")
+        # Шаг 5: Параллельная инициализация клиентов MediaWiki и Ollama
+        self.logger.info("Шаг 5: Инициализация клиентов MediaWiki и Ollama...")
+        self.http_session = create_session()
+        self.wiki_client = WikiClient(session=self.http_session)
         self.ollama_client = OllamaClient(
-            url=os.getenv('OLLAMA_URL'),
-            model=os.getenv('OLLAMA_MODEL')
+            url=self.cfg.ollama_url,
+            model=self.cfg.ollama_model,
+            db=self.db,
+            session=self.http_session
         )
-        await self.ollama_client.setup()
-        self.logger.info("✓ Клиент Ollama успешно инициализирован")
+        await asyncio.gather(
+            self.wiki_client.setup(
+                username=self.cfg.wiki_username,
+                password=self.cfg.wiki_password,
+                wiki_url=self.cfg.wiki_site
+            ),
+            self.ollama_client.setup()
+        )
+        self.wiki_queue = WikiEditQueue(self.wiki_client)
+        self.wiki_queue.start()
+        self.logger.info("✓ Клиенты MediaWiki и Ollama успешно инициализированы")
         
-        # Шаг 7: Настройка обработчиков сообщений
-        self.logger.info("Шаг 7: Настройка обработчиков сообщений...")
+        # Шаг 6: Настройка обработчиков сообщений
+        self.logger.info("Шаг 6: Настройка обработчиков сообщений...")
         await self.setup_handlers()
         self.logger.info("✓ Обработчики сообщений успешно настроены")
         
@@ -150,117 +240,154 @@ class TelegramUserClient:
         # Обработка истории сообщений
         self.logger.info("Начало обработки истории сообщений...")
         try:
-            # Получаем сообщения порциями
-            self.logger.info("Получение сообщений порциями...")
-            offset_id = 0
-            limit = 100
             total_processed = 0
             total_skipped = 0
             
-            while True:
+            # Получаем множество обработанных сообщений один раз
+            processed_messages = await self.db.get_processed_messages()
+            self.logger.info(f"В базе данных найдено {len(processed_messages)} обработанных сообщений")
+            
+            # Telethon сам подгружает следующие порции по мере итерации
+            self.logger.info("Получение сообщений порциями...")
+            page = []
+            async for message in self.client.iter_messages(self.group_peer):
+                page.append(message)
+                if len(page) < HISTORY_PAGE_SIZE:
+                    continue
+                processed, skipped = await self.process_history_page(page, processed_messages)
+                total_processed += processed
+                total_skipped += skipped
+                page = []
+            
+            if page:
+                processed, skipped = await self.process_history_page(page, processed_messages)
+                total_processed += processed
+                total_skipped += skipped
+            
+            self.logger.info(f"Итоги обработки:")
+            self.logger.info(f"- Всего обработано: {total_processed}")
+            self.logger.info(f"- Всего пропущено: {total_skipped}")
+            
+        except Exception as e:
+            self.logger.exception(f"Ошибка при обработке истории сообщений: {str(e)}")
+
+    async def process_history_page(self, messages: list, processed_messages: set) -> tuple:
+        """Обработка порции исторических сообщений"""
+        processed = 0
+        skipped = 0
+        try:
+            self.logger.info(f"Получено {len(messages)} сообщений")
+            
+            # Сообщения порции, которые будут записаны в БД одной транзакцией
+            pending_rows = []
+            
+            # Отбираем сообщения порции, которые ещё не обработаны
+            unprocessed = []
+            for message in messages:
+                if not message or not message.text:
+                    self.logger.warning(f"Пропуск пустого сообщения {message.id if message else 'unknown'}")
+                    continue
+                if message.id in processed_messages:
+                    skipped += 1
+                    self.logger.debug("Сообщение {} уже обработано, пропускаем", message.id)
+                    continue
+                unprocessed.append(message)
+            
+            # Анализируем сообщения порции пакетами, пакеты отправляются параллельно
+            self.logger.info(f"Отправка {len(unprocessed)} сообщений на анализ в Ollama...")
+            batches = [
+                unprocessed[i:i + OLLAMA_BATCH_SIZE]
+                for i in range(0, len(unprocessed), OLLAMA_BATCH_SIZE)
+            ]
+            batch_results = await asyncio.gather(
+                *(self.analyze_batch_limited([message.text for message in batch]) for batch in batches),
+                return_exceptions=True
+            )
+            analyses = []
+            for batch, result in zip(batches, batch_results):
+                if isinstance(result, Exception):
+                    analyses.extend([result] * len(batch))
+                else:
+                    analyses.extend(result)
+            
+            # Готовим правки MediaWiki для успешно проанализированных сообщений
+            edits = []
+            for message, analysis in zip(unprocessed, analyses):
                 try:
-                    self.logger.info(f"Получение сообщений (offset_id={offset_id}, limit={limit})...")
-                    messages = await self.client.get_messages(
-                        PeerChannel(self.group_id),
-                        limit=limit,
-                        offset_id=offset_id
-                    )
+                    self.logger.debug("Обработка исторического сообщения {}...", message.id)
+                    if isinstance(analysis, Exception):
+                        self.logger.error(f"Не удалось проанализировать историческое сообщение {message.id}")
+                        self.logger.error(f"Ошибка: {str(analysis)}")
+                        continue
+                    if not analysis:
+                        self.logger.error(f"Не удалось проанализировать историческое сообщение {message.id}")
+                        continue
+                    self.logger.opt(lazy=True).debug("Получен анализ от Ollama для сообщения {}: {}", lambda: message.id, lambda: analysis)
                     
-                    if not messages:
-                        self.logger.info("Больше сообщений нет")
-                        break
-                        
-                    self.logger.info(f"Получено {len(messages)} сообщений")
-                    
-                    # Получаем список обработанных сообщений
-                    processed_messages = await self.db.get_processed_messages()
-                    self.logger.info(f"В базе данных найдено {len(processed_messages)} обработанных сообщений")
-                    
-                    for message in messages:
-                        try:
-                            if not message or not message.text:
-                                self.logger.warning(f"Пропуск пустого сообщения {message.id if message else 'unknown'}")
-                                continue
-                                
-                            if message.id not in processed_messages:
-                                self.logger.info(f"Обработка исторического сообщения {message.id}...")
-                                try:
-                                    self.logger.info(f"Отправка сообщения {message.id} на анализ в Ollama...")
-                                    analysis = await self.ollama_client.analyze_text(message.text)
-                                    if analysis:
-                                        self.logger.info(f"Получен анализ от Ollama для сообщения {message.id}: {analysis}")
-                                        
-                                        # Создание или обновление страницы в MediaWiki
-                                        title = analysis.get('title', f"Сообщение_{message.id}")
-                                        content = f"## {title}\n\n{message.text}\n\n"
-                                        content += "### Метаданные\n"
-                                        content += f"- Дата: {message.date}\n"
-                                        content += f"- Автор: {message.sender_id}\n"
-                                        content += f"- ID сообщения: {message.id}\n"
-
-                                        self.logger.info(f"Подготовка данных для MediaWiki:")
-                                        self.logger.info(f"Заголовок страницы: {title}")
-                                        self.logger.info(f"Содержимое страницы:\n{content}")
+                    # Создание или обновление страницы в MediaWiki
+                    title = analysis.get('title', f"Сообщение_{message.id}")
+                    content = CONTENT_TEMPLATE.format(
+                        title=title,
+                        text=message.text,
+                        date=message.date,
+                        author=message.sender_id,
+                        mid=message.id
+                    )
 
-                                        self.logger.info(f"Создание/обновление страницы в MediaWiki для сообщения {message.id}...")
-                                        if await self.wiki_client.edit_page(title, content):
-                                            await self.db.mark_message_as_processed(message.id, title)
-                                            self.logger.info(f"✓ Сообщение {message.id} успешно обработано и сохранено в Wiki")
-                                            total_processed += 1
-                                        else:
-                                            self.logger.error(f"Не удалось создать/обновить страницу в Wiki для сообщения {message.id}")
-                                        
-                                        await self.db.add_message(
-                                            message_id=message.id,
-                                            chat_id=message.chat_id,
-                                            user_id=message.sender_id,
-                                            text=message.text,
-                                            date=message.date,
-                                            analysis=analysis
-                                        )
-                                        self.logger.info(f"✓ Сообщение {message.id} успешно обработано")
-                                    else:
-                                        self.logger.error(f"Не удалось проанализировать историческое сообщение {message.id}")
-                                except Exception as e:
-                                    self.logger.error(f"Не удалось проанализировать историческое сообщение {message.id}")
-                                    self.logger.error(f"Ошибка: {str(e)}")
-                                    self.logger.error(f"Трассировка:\n{traceback.format_exc()}")
-                            else:
-                                total_skipped += 1
-                                self.logger.info(f"Сообщение {message.id} уже обработано, пропускаем")
-                        except Exception as e:
-                            self.logger.error(f"Ошибка при обработке сообщения: {str(e)}")
-                            self.logger.error(f"Трассировка:\n{traceback.format_exc()}")
-                            continue
-                    
-                    # Обновляем offset_id для следующей порции
-                    offset_id = messages[-1].id
-                    self.logger.info(f"Обработано порции сообщений. Итоги:")
-                    self.logger.info(f"- Обработано в этой сессии: {total_processed}")
-                    self.logger.info(f"- Пропущено в этой сессии: {total_skipped}")
-                    
+                    self.logger.debug("Подготовка данных для MediaWiki:")
+                    self.logger.debug("Заголовок страницы: {}", title)
+                    self.logger.opt(lazy=True).debug("Содержимое страницы:\n{}", lambda: content)
+                    edits.append((message, analysis, title, content))
                 except Exception as e:
-                    self.logger.error(f"Ошибка при получении порции сообщений: {str(e)}")
-                    self.logger.error(f"Трассировка:\n{traceback.format_exc()}")
-                    break
+                    self.logger.exception(f"Ошибка при обработке сообщения: {str(e)}")
+                    continue
             
-            self.logger.info(f"Итоги обработки:")
-            self.logger.info(f"- Всего обработано: {total_processed}")
-            self.logger.info(f"- Всего пропущено: {total_skipped}")
+            # Отправляем правки через очередь, она выполняет их пакетами
+            self.logger.info(f"Создание/обновление {len(edits)} страниц в MediaWiki...")
+            edit_results = await asyncio.gather(
+                *(self.wiki_queue.submit(title, content) for _, _, title, content in edits),
+                return_exceptions=True
+            )
+            
+            for (message, analysis, title, _), edit_result in zip(edits, edit_results):
+                is_processed = edit_result is True
+                if is_processed:
+                    processed_messages.add(message.id)
+                    self.logger.debug("✓ Сообщение {} успешно обработано и сохранено в Wiki", message.id)
+                    processed += 1
+                else:
+                    self.logger.error(f"Не удалось создать/обновить страницу в Wiki для сообщения {message.id}")
+                
+                pending_rows.append({
+                    'message_id': message.id,
+                    'chat_id': message.chat_id,
+                    'user_id': message.sender_id,
+                    'text': message.text,
+                    'date': message.date,
+                    'analysis': orjson.dumps(analysis).decode(),
+                    'is_processed': is_processed,
+                    'wiki_page': title if is_processed else None
+                })
+                self.logger.debug("✓ Сообщение {} успешно обработано", message.id)
+            
+            # Сохраняем порцию в БД одной транзакцией
+            saved = await self.db.bulk_insert_messages(pending_rows)
+            self.logger.info(f"Сохранено в БД сообщений из порции: {saved}")
+            self.logger.info(f"Обработано порции сообщений: {processed}, пропущено: {skipped}")
             
         except Exception as e:
-            self.logger.error(f"Ошибка при обработке истории сообщений: {str(e)}")
-            self.logger.error(f"Тип ошибки: {type(e).__name__}")
-            self.logger.error(f"Трассировка:\n{traceback.format_exc()}")
+            self.logger.exception(f"Ошибка при обработке порции сообщений: {str(e)}")
+        
+        return processed, skipped
 
     async def setup_handlers(self):
         """Настройка обработчиков сообщений"""
-        @self.client.on(events.NewMessage(chats=PeerChannel(self.group_id)))
+        @self.client.on(events.NewMessage(chats=self.group_peer))
         async def handle_message(event):
             """Обработчик новых сообщений"""
             try:
                 self.logger.info(f"Получено новое сообщение: ID={event.message.id}, Chat={event.chat_id}, User={event.sender_id}")
-                self.logger.info(f"Текст сообщения: {event.message.text}")
+                self.logger.opt(lazy=True).debug("Текст сообщения: {}", lambda: event.message.text)
                 
                 # Проверяем, что сообщение не от бота
                 if event.message.out:
@@ -268,7 +395,7 @@ class TelegramUserClient:
                     return
                 
                 # Сохранение сообщения в базу данных
-                self.logger.info(f"Сохранение сообщения {event.message.id} в базу данных...")
+                self.logger.debug("Сохранение сообщения {} в базу данных...", event.message.id)
                 message = await self.db.add_message(
                     message_id=event.message.id,
                     chat_id=event.chat_id,
@@ -280,51 +407,41 @@ class TelegramUserClient:
                 if not message:
                     self.logger.error(f"Не удалось сохранить сообщение {event.message.id}")
                     return
-                self.logger.info(f"Сообщение {event.message.id} успешно сохранено в БД")
+                self.logger.debug("Сообщение {} успешно сохранено в БД", event.message.id)
 
                 # Анализ текста с помощью Ollama
-                self.logger.info(f"Отправка сообщения {event.message.id} на анализ в Ollama...")
-                analysis = await self.ollama_client.analyze_text(event.message.text)
+                self.logger.debug("Отправка сообщения {} на анализ в Ollama...", event.message.id)
+                analysis = await self.analyze_text_limited(event.message.text)
                 if not analysis:
                     self.logger.error(f"Не удалось проанализировать сообщение {event.message.id}")
                     return
-                self.logger.info(f"Получен анализ от Ollama для сообщения {event.message.id}: {analysis}")
+                self.logger.opt(lazy=True).debug("Получен анализ от Ollama для сообщения {}: {}", lambda: event.message.id, lambda: analysis)
 
                 # Создание или обновление страницы в MediaWiki
                 title = analysis.get('title', f"Сообщение_{event.message.id}")
-                content = f"## {title}\n\n{event.message.text}\n\n"
-                content += "### Метаданные\n"
-                content += f"- Дата: {event.message.date}\n"
-                content += f"- Автор: {event.sender_id}\n"
-                content += f"- ID сообщения: {event.message.id}\n"
+                content = CONTENT_TEMPLATE.format(
+                    title=title,
+                    text=event.message.text,
+                    date=event.message.date,
+                    author=event.sender_id,
+                    mid=event.message.id
+                )
 
-                self.logger.info(f"Подготовка данных для MediaWiki:")
-                self.logger.info(f"Заголовок страницы: {title}")
-                self.logger.info(f"Содержимое страницы:\n{content}")
+                self.logger.debug("Подготовка данных для MediaWiki:")
+                self.logger.debug("Заголовок страницы: {}", title)
+                self.logger.opt(lazy=True).debug("Содержимое страницы:\n{}", lambda: content)
 
-                self.logger.info(f"Создание/обновление страницы в MediaWiki для сообщения {event.message.id}...")
-                if await self.wiki_client.edit_page(title, content):
+                self.logger.debug("Создание/обновление страницы в MediaWiki для сообщения {}...", event.message.id)
+                if await self.wiki_queue.submit(title, content):
                     await self.db.mark_message_as_processed(event.message.id, title)
                     self.logger.info(f"Сообщение {event.message.id} успешно обработано и сохранено в Wiki")
                 else:
                     self.logger.error(f"Не удалось создать/обновить страницу в Wiki для сообщения {event.message.id}")
 
             except Exception as e:
-                self.logger.error(f"Ошибка при обработке сообщения: {str(e)}")
-                self.logger.error(f"Тип ошибки: {type(e).__name__}")
-                self.logger.error(f"Трассировка:\n{traceback.format_exc()}")
+                self.logger.exception(f"Ошибка при обработке сообщения: {str(e)}")
 
-        # Добавляем обработчик для всех сообщений в группе
-        @self.client.on(events.NewMessage(chats=PeerChannel(self.group_id)))
-        async def log_all_messages(event):
-            """Логирование всех сообщений"""
-            try:
-                self.logger.info(f"Новое сообщение в группе: ID={event.message.id}, Chat={event.chat_id}, User={event.sender_id}")
-                self.logger.info(f"Текст: {event.message.text}")
-            except Exception as e:
-                self.logger.error(f"Ошибка при логировании сообщения: {str(e)}")
-
-        self.logger.info(f"Обработчики сообщений настроены для группы {self.group_id}")
+        self.logger.info(f"Обработчики сообщений настроены для группы {self.cfg.group_id}")
 
 async def main():
     """Основная функция"""
@@ -336,16 +453,24 @@ async def main():
             client.logger.info("Клиент запущен и ожидает сообщения...")
             await client.client.run_until_disconnected()
     except Exception as e:
-        client.logger.error(f"Критическая ошибка: {str(e)}")
-        client.logger.error(f"Тип ошибки: {type(e).__name__}")
-        client.logger.error(f"Трассировка:\n{traceback.format_exc()}")
+        client.logger.exception(f"Критическая ошибка: {str(e)}")
     finally:
         if client.db:
             await client.db.close()
         if client.ollama_client:
             await client.ollama_client.close()
+        if client.wiki_queue:
+            await client.wiki_queue.close()
         if client.wiki_client and hasattr(client.wiki_client, 'close'):
             await client.wiki_client.close()
+        if client.http_session:
+            await client.http_session.close()
 
 if __name__ == "__main__":
+    # uvloop ускоряет сетевой ввод-вывод цикла событий; на Windows он недоступен
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main()) 
\ No newline at end of file
@@ -1,16 +1,144 @@
 import aiohttp
-import json
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any, Optional
-import traceback
+import msgspec
+import orjson
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+class AnalysisResult(msgspec.Struct):
+    """Поля анализа, которые используются ботом; остальные поля ответа модели пропускаются
+
+    Строго проверяется только title. Остальные поля сохраняются как есть, чтобы
+    неожиданная форма (например, строка вместо списка) не отбрасывала весь анализ.
+    """
+    title: Optional[str] = None
+    summary: Any = None
+    categories: Any = None
+    tags: Any = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Преобразование в словарь без незаполненных полей"""
+        return {key: value for key, value in msgspec.structs.asdict(self).items() if value is not None}
+
+# Статические части промптов собираются один раз; при вызове подставляется только текст
+_PROMPT_PREFIX = """Проанализируй следующий текст и верни результат в формате JSON:
+            {
+                "title": "Краткий заголовок (до 5 слов)",
+                "summary": "Краткое описание (1-2 предложения)",
+                "categories": ["категория1", "категория2"],
+                "tags": ["тег1", "тег2"]
+            }
+
+            Текст для анализа:
+            """
+_PROMPT_SUFFIX = """
+
+            Верни ТОЛЬКО JSON, без дополнительного текста."""
+
+_BATCH_PROMPT_PREFIX = """Проанализируй каждый из следующих текстов и верни результат в формате JSON-массива,
+            по одному объекту на каждый текст в том же порядке:
+            [
+                {
+                    "title": "Краткий заголовок (до 5 слов)",
+                    "summary": "Краткое описание (1-2 предложения)",
+                    "categories": ["категория1", "категория2"],
+                    "tags": ["тег1", "тег2"]
+                }
+            ]
+
+            Тексты для анализа:
+            """
+_BATCH_PROMPT_SUFFIX = """
+
+            Верни ТОЛЬКО JSON-массив из {count} элементов, без дополнительного текста."""
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Для потоковой генерации ограничивается пауза между фрагментами, а не общее время:
+# ожидание в очереди сервера и длинный ответ не должны обрывать запрос
+_GENERATE_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=300)
+
+# Первая версия Ollama с параметром format=json
+JSON_FORMAT_MIN_VERSION = (0, 1, 9)
+
+# Ограничения кеша анализов в памяти (перед кешем в базе данных)
+MEMORY_CACHE_SIZE = 256
+MEMORY_CACHE_TTL = 3600
+
+_analysis_decoder = msgspec.json.Decoder(AnalysisResult)
+_analysis_batch_decoder = msgspec.json.Decoder(List[AnalysisResult])
+
+# Строка JSON целиком (с учетом экранирования) или скобка
+_JSON_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]')
+
+def _extract_json_span(text: str, opener: str = '{') -> Optional[Tuple[int, int]]:
+    """Границы первого JSON-значения, начинающегося с opener, за один проход
+
+    Скобки внутри строк не учитываются. Возвращает None, если значение
+    не найдено или обрезано.
+    """
+    start = text.find(opener)
+    if start == -1:
+        return None
+    depth = 0
+    for match in _JSON_TOKEN.finditer(text, start):
+        token = match.group()
+        if token in '{[':
+            depth += 1
+        elif token in '}]':
+            depth -= 1
+            if depth == 0:
+                return start, match.end()
+    return None
+
+def _json_dumps(obj: Any) -> str:
+    """Сериализация JSON для aiohttp через orjson"""
+    return orjson.dumps(obj).decode()
+
+def create_session() -> aiohttp.ClientSession:
+    """Создание HTTP-сессии с пулом keep-alive соединений (одна на приложение)"""
+    connector = aiohttp.TCPConnector(
+        limit=32,
+        limit_per_host=8,
+        keepalive_timeout=75,
+        ttl_dns_cache=300
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        # Сессия общая с MediaWiki: cookie входа нужно сохранять и для сайтов, заданных IP-адресом
+        cookie_jar=aiohttp.CookieJar(unsafe=True),
+        timeout=aiohttp.ClientTimeout(total=300, sock_connect=10),
+        json_serialize=_json_dumps
+    )
+
+def hash_text(text: str) -> str:
+    """Хеш текста для ключа кеша анализов"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
 class OllamaClient:
-    def __init__(self, url: str, model: str):
+    def __init__(self, url: str, model: str, db=None, session: Optional[aiohttp.ClientSession] = None):
         self.base_url = url.rstrip('/')
         self.model = model
-        self.session = None
+        self._generate_url = f"{self.base_url}/api/generate"
+        # Постоянная часть тела запроса генерации сериализуется один раз,
+        # при вызове в JSON кодируется только промпт
+        self._generate_body_prefix = orjson.dumps({"model": model, "stream": True})[:-1] + b',"prompt":'
+        self._generate_json_body_prefix = orjson.dumps({"model": model, "stream": True, "format": "json"})[:-1] + b',"prompt":'
+        # Ограничение вывода модели корректным JSON включается в setup по версии сервера
+        self._json_format = False
+        # Переданная сессия принадлежит приложению и не закрывается клиентом
+        self.session = session
+        self._owns_session = session is None
+        # База данных для кеширования результатов анализа (необязательно)
+        self.db = db
+        # Кеш последних анализов в памяти: хеш текста -> (время сохранения, анализ)
+        self._memory_cache: OrderedDict = OrderedDict()
         logger.info(f"Инициализация клиента Ollama для {self.base_url}")
 
     async def setup(self):
@@ -18,112 +146,242 @@ class OllamaClient:
         logger.info(f"Начало инициализации клиента Ollama для {self.base_url}")
         
         try:
-            logger.info("Создание HTTP сессии...")
-            self.session = aiohttp.ClientSession()
-            logger.info("HTTP сессия успешно создана")
+            if self.session is None:
+                logger.info("Создание HTTP сессии...")
+                self.session = create_session()
+                logger.info("HTTP сессия успешно создана")
             
-            # Проверка доступности модели
+            # Проверка доступности модели: /api/show отвечает 404, если модели нет
             logger.info("Проверка доступности модели Ollama...")
-            async with self.session.get(f"{self.base_url}/api/tags") as response:
+            async with self.session.post(
+                f"{self.base_url}/api/show",
+                data=orjson.dumps({"name": self.model}),
+                headers=_JSON_HEADERS
+            ) as response:
                 if response.status == 200:
-                    models = await response.json()
-                    if any(model['name'] == self.model for model in models.get('models', [])):
-                        logger.info("Модель Ollama доступна")
-                    else:
-                        raise ValueError(f"Модель {self.model} не найдена на сервере")
+                    logger.info("Модель Ollama доступна")
+                elif response.status == 404:
+                    raise ValueError(f"Модель {self.model} не найдена на сервере")
                 else:
-                    raise ConnectionError(f"Ошибка при проверке моделей: {response.status}")
+                    raise ConnectionError(f"Ошибка при проверке модели: {response.status}")
+
+            self._json_format = await self._supports_json_format()
+            if not self._json_format:
+                logger.warning("Сервер Ollama не поддерживает format=json, ответ модели будет очищаться вручную")
             
             logger.info(f"Успешное подключение к Ollama: {self.base_url}")
             return True
             
         except Exception as e:
             logger.error(f"Ошибка при инициализации клиента Ollama: {str(e)}")
-            if self.session:
-                await self.session.close()
+            await self.close()
             raise
 
-    async def analyze_text(self, text: str) -> Optional[Dict[str, Any]]:
-        """Анализ текста с помощью Ollama"""
+    async def _supports_json_format(self) -> bool:
+        """Проверка версии сервера Ollama на поддержку format=json"""
         try:
-            logger.info(f"Начало анализа текста длиной {len(text)} символов")
-            
-            # Формируем промпт для анализа
-            prompt = f"""Проанализируй следующий текст и верни результат в формате JSON:
-            {{
-                "title": "Краткий заголовок (до 5 слов)",
-                "summary": "Краткое описание (1-2 предложения)",
-                "categories": ["категория1", "категория2"],
-                "tags": ["тег1", "тег2"]
-            }}
+            async with self.session.get(f"{self.base_url}/api/version") as response:
+                if response.status != 200:
+                    return False
+                version = orjson.loads(await response.read()).get('version', '')
+        except (aiohttp.ClientError, orjson.JSONDecodeError):
+            return False
+        numbers = tuple(int(part) for part in re.findall(r'\d+', version)[:3])
+        return numbers >= JSON_FORMAT_MIN_VERSION
 
-            Текст для анализа:
-            {text}
-
-            Верни ТОЛЬКО JSON, без дополнительного текста."""
-
-            logger.info("Отправка запроса к Ollama...")
-            response = await self.session.post(
-                f"{self.base_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "stream": False
-                }
-            )
-            logger.info("Получен ответ от Ollama")
+    async def _generate_stream(self, prompt: str, json_format: bool = False) -> AsyncIterator[str]:
+        """Потоковая генерация: фрагменты ответа модели выдаются по мере получения
 
+        При json_format=True сервер ограничивает вывод модели одним JSON-объектом.
+        """
+        logger.debug("Отправка запроса к Ollama...")
+        prefix = self._generate_json_body_prefix if json_format else self._generate_body_prefix
+        body = prefix + orjson.dumps(prompt) + b'}'
+        async with self.session.post(
+            self._generate_url,
+            data=body,
+            headers=_JSON_HEADERS,
+            timeout=_GENERATE_TIMEOUT
+        ) as response:
             if response.status != 200:
                 error_text = await response.text()
-                logger.error(f"Ошибка API Ollama: {response.status} - {error_text}")
-                return None
+                raise ConnectionError(f"Ошибка API Ollama: {response.status} - {error_text}")
 
-            result = await response.json()
-            logger.info(f"Получен ответ от Ollama API: {result}")
+            # Ollama возвращает NDJSON: по одному объекту на строку
+            done = False
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                chunk = orjson.loads(line)
+                yield chunk.get('response', '')
+                if chunk.get('done'):
+                    done = True
+                    break
 
-            # Извлекаем JSON из ответа
-            response_text = result.get('response', '')
-            logger.info(f"Получен ответ от модели:\n{response_text}")
+            if not done:
+                raise ConnectionError("Поток ответа Ollama оборвался до завершения генерации")
 
-            # Пытаемся найти JSON в ответе
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
+    async def _generate(self, prompt: str, json_format: bool = False) -> Optional[str]:
+        """Отправка промпта в Ollama и получение полного текста ответа модели"""
+        chunks = []
+        try:
+            async for token in self._generate_stream(prompt, json_format):
+                chunks.append(token)
+        except (ConnectionError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(str(e) or f"Ошибка запроса к Ollama: {type(e).__name__}")
+            return None
+        logger.debug("Получен ответ от Ollama")
 
-            if json_start == -1 or json_end == 0:
-                logger.error("Не удалось найти JSON в ответе")
-                return None
+        response_text = "".join(chunks)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Получен ответ от модели:\n%s", response_text)
+        return response_text
+
+    def _remember(self, text_hash: str, analysis: Dict[str, Any]):
+        """Сохранение анализа в кеш в памяти с вытеснением самых старых записей"""
+        self._memory_cache[text_hash] = (time.monotonic(), analysis)
+        self._memory_cache.move_to_end(text_hash)
+        while len(self._memory_cache) > MEMORY_CACHE_SIZE:
+            self._memory_cache.popitem(last=False)
+
+    async def _get_cached(self, text: str) -> Optional[Dict[str, Any]]:
+        """Получение анализа текста из кеша: сначала из памяти, затем из базы данных"""
+        text_hash = hash_text(text)
+        entry = self._memory_cache.get(text_hash)
+        if entry is not None:
+            stored_at, analysis = entry
+            if time.monotonic() - stored_at < MEMORY_CACHE_TTL:
+                self._memory_cache.move_to_end(text_hash)
+                return analysis
+            del self._memory_cache[text_hash]
+
+        if self.db is None:
+            return None
+        analysis = await self.db.get_cached_analysis(text_hash)
+        if analysis is not None:
+            self._remember(text_hash, analysis)
+        return analysis
+
+    async def _store_cached(self, text: str, analysis: Dict[str, Any]):
+        """Сохранение анализа текста в кеш"""
+        text_hash = hash_text(text)
+        self._remember(text_hash, analysis)
+        if self.db is not None:
+            await self.db.cache_analysis(text_hash, analysis)
+
+    def _analysis_prompt(self, text: str) -> str:
+        """Формирование промпта для анализа текста"""
+        return _PROMPT_PREFIX + text + _PROMPT_SUFFIX
+
+    async def analyze_text_stream(self, text: str) -> AsyncIterator[str]:
+        """Потоковый анализ текста: выдает фрагменты ответа модели по мере генерации"""
+        async for token in self._generate_stream(self._analysis_prompt(text), self._json_format):
+            yield token
+
+    async def analyze_text(self, text: str) -> Optional[Dict[str, Any]]:
+        """Анализ текста с помощью Ollama"""
+        try:
+            cached = await self._get_cached(text)
+            if cached is not None:
+                logger.debug("Анализ текста найден в кеше")
+                return cached
 
-            json_text = response_text[json_start:json_end]
-            logger.info(f"Извлеченный JSON:\n{json_text}")
+            logger.debug("Начало анализа текста длиной %d символов", len(text))
+            response_text = await self._generate(self._analysis_prompt(text), self._json_format)
+            if response_text is None:
+                return None
 
-            # Очищаем JSON от возможных лишних символов
-            json_text = json_text.strip()
-            if json_text.startswith('```json'):
-                json_text = json_text[7:]
-            if json_text.endswith('```'):
-                json_text = json_text[:-3]
-            json_text = json_text.strip()
+            if self._json_format:
+                # С format=json ответ модели уже является JSON-объектом
+                json_text = response_text
+            else:
+                # Старый сервер: ищем JSON в ответе; обрезанный ответ не разбираем
+                span = _extract_json_span(response_text)
+                if span is None:
+                    logger.error("Не удалось найти полный JSON в ответе")
+                    return None
 
-            logger.info(f"Очищенный JSON:\n{json_text}")
+                json_text = response_text[span[0]:span[1]]
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Извлеченный JSON:\n%s", json_text)
 
             # Парсим JSON
             try:
-                result = json.loads(json_text)
-                logger.info(f"Успешно распарсен JSON: {result}")
+                result = _analysis_decoder.decode(json_text).to_dict()
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Успешно распарсен JSON: %s", result)
+                await self._store_cached(text, result)
                 return result
-            except json.JSONDecodeError as e:
+            except msgspec.DecodeError as e:
                 logger.error(f"Ошибка парсинга JSON: {str(e)}")
                 logger.error(f"Проблемный JSON:\n{json_text}")
                 return None
 
         except Exception as e:
-            logger.error(f"Ошибка при анализе текста: {str(e)}")
-            logger.error(f"Тип ошибки: {type(e).__name__}")
-            logger.error(f"Трассировка:\n{traceback.format_exc()}")
+            logger.exception(f"Ошибка при анализе текста: {str(e)}")
             return None
 
+    async def analyze_batch(self, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Анализ нескольких текстов одним запросом к Ollama"""
+        if not texts:
+            return []
+
+        # В Ollama отправляем только тексты, которых нет в кеше
+        results = [await self._get_cached(text) for text in texts]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            logger.info(f"В кеше найдено {len(texts) - len(missing)} из {len(texts)} анализов")
+            analyses = await self._analyze_batch([texts[i] for i in missing])
+            for i, analysis in zip(missing, analyses):
+                results[i] = analysis
+        return results
+
+    async def _analyze_batch(self, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Пакетный анализ текстов, отсутствующих в кеше"""
+        if len(texts) == 1:
+            return [await self.analyze_text(texts[0])]
+
+        try:
+            logger.info(f"Начало пакетного анализа {len(texts)} текстов")
+
+            # Формируем промпт с пронумерованными текстами
+            numbered_texts = "\n\n".join(f"{i}. {text}" for i, text in enumerate(texts, 1))
+            prompt = _BATCH_PROMPT_PREFIX + numbered_texts + _BATCH_PROMPT_SUFFIX.format(count=len(texts))
+
+            # Сервер недоступен или не ответил: запросы по одному тексту тоже не пройдут
+            response_text = await self._generate(prompt)
+            if response_text is None:
+                return [None] * len(texts)
+
+            # Пытаемся найти JSON-массив в ответе; обрезанный ответ не разбираем
+            span = _extract_json_span(response_text, '[')
+            if span is None:
+                raise ValueError("Не удалось найти полный JSON-массив в ответе")
+
+            json_text = response_text[span[0]:span[1]]
+
+            results = [
+                result.to_dict()
+                for result in _analysis_batch_decoder.decode(json_text)
+            ]
+            if len(results) != len(texts):
+                raise ValueError("Количество результатов не совпадает с количеством текстов")
+
+            logger.info(f"Пакетный анализ {len(texts)} текстов успешно выполнен")
+            for text, result in zip(texts, results):
+                await self._store_cached(text, result)
+            return results
+
+        except (msgspec.DecodeError, ValueError) as e:
+            # Модель ответила, но ответ не удалось разобрать: повторяем по одному тексту
+            logger.warning(f"Пакетный анализ не удался ({str(e)}), анализируем тексты по одному")
+            return [await self.analyze_text(text) for text in texts]
+        except Exception as e:
+            logger.exception(f"Ошибка при пакетном анализе текстов: {str(e)}")
+            return [None] * len(texts)
+
     async def close(self):
         """Закрытие сессии"""
-        if self.session:
+        if self.session and self._owns_session:
             await self.session.close()
-            self.session = None 
\ No newline at end of file
+        self.session = None 
\ No newline at end of file
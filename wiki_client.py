@@ -1,17 +1,61 @@
-import mwclient
+import aiohttp
+import orjson
 from loguru import logger
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
-import traceback
+import functools
 import os
 from pathlib import Path
 
+# Максимальное число заголовков в одном запросе query (ограничение API для обычных учетных записей)
+QUERY_TITLES_LIMIT = 50
+# Максимальное число одновременных сохранений страниц
+SAVE_CONCURRENCY = 4
+# Размер блока при поблочной загрузке файлов
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Число потоков для блокирующих операций клиента (чтение загружаемых файлов)
+WIKI_THREAD_WORKERS = 4
+
+USER_AGENT = 'DBTeleBot/1.0'
+_HEADERS = {'User-Agent': USER_AGENT}
+
+# Символы, недопустимые в названии категории: они ломают разметку ссылки [[Category:...]]
+_CATEGORY_STRIP = str.maketrans('', '', '[]|')
+
+class WikiAPIError(Exception):
+    """Ошибка, возвращенная API MediaWiki"""
+
+    def __init__(self, code: str, info: str):
+        super().__init__(f"{code}: {info}")
+        self.code = code
+        self.info = info
+
+@dataclass(slots=True)
+class WikiPage:
+    """Состояние страницы, полученное одним запросом query"""
+    title: str
+    exists: bool
+    content: str = ''
+    # Отметки времени нужны MediaWiki для обнаружения конфликтов правок
+    base_timestamp: Optional[str] = None
+    start_timestamp: Optional[str] = None
+
 class WikiClient:
-    def __init__(self):
-        self.site: Optional[mwclient.Site] = None
+    def __init__(self, session: Optional[aiohttp.ClientSession] = None):
+        # Переданная сессия принадлежит приложению и не закрывается клиентом
+        self.session = session
+        self._owns_session = session is None
+        self.api_url: Optional[str] = None
         self.username: Optional[str] = None
         self.password: Optional[str] = None
         self.wiki_url: Optional[str] = None
+        self._csrf_token: Optional[str] = None
+        self._logged_in = False
+        self._save_semaphore = asyncio.Semaphore(SAVE_CONCURRENCY)
+        # Отдельный пул потоков, чтобы файловые операции не занимали общий пул цикла событий
+        self._executor = ThreadPoolExecutor(max_workers=WIKI_THREAD_WORKERS, thread_name_prefix="wiki")
 
     async def setup(self, username: str, password: str, wiki_url: str) -> bool:
         """Инициализация клиента MediaWiki"""
@@ -21,120 +65,307 @@ class WikiClient:
             self.password = password
             self.wiki_url = wiki_url
 
-            # Подключение к MediaWiki в отдельном потоке
             logger.info("Создание подключения к MediaWiki...")
             
             # Извлекаем домен из URL
-            domain = wiki_url.replace('https://', '').replace('http://', '')
-            
-            # Создаем сайт с отключенным интерактивным вводом
-            self.site = await asyncio.to_thread(
-                mwclient.Site,
-                domain,
-                path='/',  # Путь к API (mwclient автоматически добавит api.php)
-                scheme='https',  # Используем HTTPS
-                clients_useragent='DBTeleBot/1.0'
-            )
+            domain = wiki_url.replace('https://', '').replace('http://', '').rstrip('/')
+            self.api_url = f"https://{domain}/api.php"
+
+            if self.session is None:
+                self.session = aiohttp.ClientSession(
+                    # unsafe=True: cookie входа сохраняются и для сайтов, заданных IP-адресом
+                    cookie_jar=aiohttp.CookieJar(unsafe=True),
+                    timeout=aiohttp.ClientTimeout(total=300, sock_connect=10)
+                )
             logger.info("Подключение к MediaWiki успешно создано")
             
-            # Авторизация в отдельном потоке
             logger.info("Выполнение авторизации в MediaWiki...")
-            await asyncio.to_thread(
-                self.site.login,
-                username,
-                password
-            )
+            await self._login(username, password)
             logger.info("Авторизация в MediaWiki успешно выполнена")
             
             logger.info(f"Успешное подключение к MediaWiki: {wiki_url}")
             return True
 
         except Exception as e:
-            logger.error(f"Ошибка при подключении к MediaWiki: {str(e)}")
-            logger.error(f"Тип ошибки: {type(e).__name__}")
-            logger.error(f"Трассировка:\n{traceback.format_exc()}")
+            logger.exception(f"Ошибка при подключении к MediaWiki: {str(e)}")
             return False
 
-    async def create_page(self, title: str, content: str, categories: list = None) -> bool:
+    async def _api(self, action: str, files: Optional[Dict[str, Tuple[str, bytes]]] = None, **params) -> Dict[str, Any]:
+        """POST-запрос к api.php; после входа добавляет assert=user"""
+        if not self.api_url:
+            raise ValueError("Клиент MediaWiki не инициализирован")
+
+        fields = {'action': action, 'format': 'json', 'formatversion': '2'}
+        if self._logged_in:
+            fields['assert'] = 'user'
+        fields.update({key: str(value) for key, value in params.items() if value is not None})
+
+        if files:
+            data = aiohttp.FormData(fields)
+            for name, (filename, content) in files.items():
+                data.add_field(name, content, filename=filename, content_type='application/octet-stream')
+        else:
+            data = fields
+
+        async with self.session.post(self.api_url, data=data, headers=_HEADERS) as response:
+            response.raise_for_status()
+            result = orjson.loads(await response.read())
+
+        error = result.get('error')
+        if error:
+            raise WikiAPIError(error.get('code', ''), error.get('info', ''))
+        return result
+
+    async def _run_blocking(self, func, *args):
+        """Выполнение блокирующей функции в пуле потоков клиента"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def _get_token(self, token_type: str = 'csrf') -> str:
+        """Получение токена MediaWiki"""
+        result = await self._api('query', meta='tokens', type=token_type)
+        return result['query']['tokens'][f'{token_type}token']
+
+    async def _login(self, username: str, password: str):
+        """Вход через action=login (пароль бота)"""
+        self._logged_in = False
+        self._csrf_token = None
+        login_token = await self._get_token('login')
+        result = await self._api('login', lgname=username, lgpassword=password, lgtoken=login_token)
+        login = result.get('login', {})
+        if login.get('result') != 'Success':
+            raise WikiAPIError(login.get('result', 'Failed'), login.get('reason', 'Ошибка авторизации'))
+        self._logged_in = True
+
+        # Токен для правок запрашивается сразу после входа и переиспользуется до badtoken
+        self._csrf_token = await self._get_token('csrf')
+
+    async def _csrf(self) -> str:
+        """CSRF-токен запрашивается один раз и используется для всех правок"""
+        if self._csrf_token is None:
+            self._csrf_token = await self._get_token('csrf')
+        return self._csrf_token
+
+    async def _api_with_token(self, action: str, files: Optional[Dict[str, Tuple[str, bytes]]] = None, **params) -> Dict[str, Any]:
+        """Запрос, требующий CSRF-токена; при устаревшем токене он обновляется один раз"""
+        try:
+            return await self._api(action, files, token=await self._csrf(), **params)
+        except WikiAPIError as e:
+            if e.code != 'badtoken':
+                raise
+            self._csrf_token = None
+            return await self._api(action, files, token=await self._csrf(), **params)
+
+    async def _query_pages(self, titles: List[str]) -> Dict[str, WikiPage]:
+        """Получение сведений и содержимого нескольких страниц запросами до QUERY_TITLES_LIMIT заголовков
+
+        Ключи результата - запрошенные заголовки; WikiPage.title содержит заголовок,
+        нормализованный MediaWiki, поэтому разные написания одной страницы
+        получают один и тот же объект.
+        """
+        pages: Dict[str, WikiPage] = {}
+        by_page_title: Dict[str, WikiPage] = {}
+        unique_titles = list(dict.fromkeys(titles))
+        for start in range(0, len(unique_titles), QUERY_TITLES_LIMIT):
+            chunk = unique_titles[start:start + QUERY_TITLES_LIMIT]
+            result = await self._api(
+                'query',
+                titles='|'.join(chunk),
+                prop='revisions',
+                rvprop='content|timestamp',
+                rvslots='main',
+                curtimestamp=1
+            )
+            query = result['query']
+            start_timestamp = result.get('curtimestamp')
+
+            # API возвращает страницы под нормализованными заголовками
+            normalized = {item['from']: item['to'] for item in query.get('normalized', ())}
+            by_title = {info['title']: info for info in query['pages']}
+            for title in chunk:
+                info = by_title.get(normalized.get(title, title))
+                if info is None:
+                    continue
+                if info.get('invalid'):
+                    raise WikiAPIError('invalidtitle', info.get('invalidreason', title))
+
+                page_title = info['title']
+                page = by_page_title.get(page_title)
+                if page is None:
+                    revisions = info.get('revisions')
+                    if info.get('missing') or not revisions:
+                        page = WikiPage(title=page_title, exists=False)
+                    else:
+                        revision = revisions[0]
+                        page = WikiPage(
+                            title=page_title,
+                            exists=True,
+                            content=revision['slots']['main']['content'],
+                            base_timestamp=revision['timestamp'],
+                            start_timestamp=start_timestamp
+                        )
+                    by_page_title[page_title] = page
+                pages[title] = page
+        return pages
+
+    async def _fetch_page(self, title: str) -> WikiPage:
+        """Получение страницы и её текущего содержимого одним запросом к API"""
+        pages = await self._query_pages([title])
+        return pages.get(title) or WikiPage(title=title, exists=False)
+
+    async def _save(self, page: WikiPage, content: str, summary: str):
+        """Сохранение текста страницы через action=edit"""
+        result = await self._api_with_token(
+            'edit',
+            title=page.title,
+            text=content,
+            summary=summary,
+            bot=1,
+            notminor=1,
+            basetimestamp=page.base_timestamp,
+            starttimestamp=page.start_timestamp
+        )
+        edit = result.get('edit', {})
+        if edit.get('result') != 'Success':
+            raise WikiAPIError('editfailed', str(edit))
+
+    async def create_page(self, title: str, content: str, categories: list = None, page: Optional[WikiPage] = None) -> bool:
         """Создание новой страницы"""
         try:
-            if not self.site:
+            if not self.api_url:
                 raise ValueError("Клиент MediaWiki не инициализирован")
 
-            logger.info(f"Создание страницы: {title}")
-            logger.info(f"Содержимое страницы:\n{content}")
+            logger.debug("Создание страницы: {}", title)
+            logger.opt(lazy=True).debug("Содержимое страницы:\n{}", lambda: content)
             
-            page = self.site.pages[title]
+            if page is None:
+                page = WikiPage(title=title, exists=False)
             
             # Добавление категорий
             if categories:
-                content += "\n\n[[Category:" + "]]\n[[Category:".join(categories) + "]]"
-                logger.info(f"Добавлены категории: {categories}")
-
-            # Создание страницы в отдельном потоке
-            logger.info(f"Сохранение страницы {title} в MediaWiki...")
-            await asyncio.to_thread(
-                page.save,
-                content,
-                "Создание страницы ботом"
-            )
+                content += "\n\n" + "\n".join(
+                    f"[[Category:{category.translate(_CATEGORY_STRIP)}]]" for category in categories
+                )
+                logger.debug("Добавлены категории: {}", categories)
+
+            logger.debug("Сохранение страницы {} в MediaWiki...", title)
+            await self._save(page, content, "Создание страницы ботом")
             logger.info(f"Создана новая страница: {title}")
             return True
 
         except Exception as e:
-            logger.error(f"Ошибка при создании страницы {title}: {str(e)}")
-            logger.error(f"Тип ошибки: {type(e).__name__}")
-            logger.error(f"Трассировка:\n{traceback.format_exc()}")
+            logger.exception(f"Ошибка при создании страницы {title}: {str(e)}")
             return False
 
+    async def create_pages(self, items: List[Tuple[str, str, Optional[list]]]) -> List[bool]:
+        """Пакетное создание страниц: один запрос на чтение и параллельные сохранения"""
+        if not items:
+            return []
+        try:
+            if not self.api_url:
+                raise ValueError("Клиент MediaWiki не инициализирован")
+
+            # Токен запрашивается до параллельных сохранений, чтобы не получать его в каждом из них
+            await self._csrf()
+            pages = await self._query_pages([title for title, _, _ in items])
+        except Exception as e:
+            logger.exception(f"Ошибка при подготовке пакета из {len(items)} страниц: {str(e)}")
+            return [False] * len(items)
+
+        async def create_one(title: str, content: str, categories: Optional[list]) -> bool:
+            async with self._save_semaphore:
+                return await self.create_page(title, content, categories, page=pages.get(title))
+
+        return list(await asyncio.gather(
+            *(create_one(title, content, categories) for title, content, categories in items)
+        ))
+
     async def edit_page(self, title: str, content: str, append: bool = True) -> bool:
         """Редактирование существующей страницы"""
         try:
-            if not self.site:
+            if not self.api_url:
                 raise ValueError("Клиент MediaWiki не инициализирован")
 
-            logger.info(f"Редактирование страницы: {title}")
-            logger.info(f"Новое содержимое:\n{content}")
-            
-            page = self.site.pages[title]
+            logger.debug("Редактирование страницы: {}", title)
+            logger.opt(lazy=True).debug("Новое содержимое:\n{}", lambda: content)
             
+            logger.debug("Получение текущего содержимого страницы {}", title)
+            page = await self._fetch_page(title)
+        except Exception as e:
+            logger.exception(f"Ошибка при редактировании страницы {title}: {str(e)}")
+            return False
+
+        return await self._apply_edit(title, content, page, append)
+
+    async def edit_pages(self, items: List[Tuple[str, str]]) -> List[bool]:
+        """Пакетное дополнение страниц
+
+        Содержимое всех страниц пакета читается одним запросом, правки одной
+        страницы объединяются в одно сохранение, разные страницы сохраняются
+        параллельно. Возвращает результат для каждой правки в исходном порядке.
+        """
+        if not items:
+            return []
+        try:
+            if not self.api_url:
+                raise ValueError("Клиент MediaWiki не инициализирован")
+
+            # Токен запрашивается до параллельных сохранений, чтобы не получать его в каждом из них
+            await self._csrf()
+            pages = await self._query_pages([title for title, _ in items])
+        except Exception as e:
+            logger.exception(f"Ошибка при подготовке пакета из {len(items)} правок: {str(e)}")
+            return [False] * len(items)
+
+        # Последовательные дополнения одной страницы равносильны одному дополнению.
+        # Группировка идет по нормализованному заголовку: "A_b" и "A b" - одна страница
+        by_title: Dict[str, List[str]] = {}
+        page_by_title: Dict[str, WikiPage] = {}
+        item_titles: List[str] = []
+        for title, content in items:
+            page = pages.get(title) or WikiPage(title=title, exists=False)
+            page_by_title.setdefault(page.title, page)
+            by_title.setdefault(page.title, []).append(content)
+            item_titles.append(page.title)
+
+        async def edit_one(title: str, contents: List[str]) -> bool:
+            async with self._save_semaphore:
+                return await self._apply_edit(title, "\n\n".join(contents), page_by_title[title], True)
+
+        results = await asyncio.gather(*(edit_one(title, contents) for title, contents in by_title.items()))
+        by_result = dict(zip(by_title, results))
+        return [by_result[title] for title in item_titles]
+
+    async def _apply_edit(self, title: str, content: str, page: WikiPage, append: bool) -> bool:
+        """Сохранение правки страницы с уже полученным содержимым"""
+        try:
             if not page.exists:
-                logger.info(f"Страница {title} не существует, создаем новую")
-                return await self.create_page(title, content)
+                logger.debug("Страница {} не существует, создаем новую", title)
+                return await self.create_page(title, content, page=page)
 
-            # Получение текущего содержимого в отдельном потоке
-            logger.info(f"Получение текущего содержимого страницы {title}")
-            current_content = await asyncio.to_thread(page.text)
-            logger.info(f"Текущее содержимое страницы:\n{current_content}")
+            logger.opt(lazy=True).debug("Текущее содержимое страницы:\n{}", lambda: page.content)
             
             # Добавление нового содержимого
             if append:
-                new_content = current_content + "\n\n" + content
-                logger.info("Режим добавления: новое содержимое будет добавлено в конец")
+                new_content = page.content + "\n\n" + content
+                logger.debug("Режим добавления: новое содержимое будет добавлено в конец")
             else:
                 new_content = content
-                logger.info("Режим перезаписи: текущее содержимое будет заменено")
-
-            # Сохранение изменений в отдельном потоке
-            logger.info(f"Сохранение изменений страницы {title}")
-            await asyncio.to_thread(
-                page.save,
-                new_content,
-                "Обновление страницы ботом"
-            )
+                logger.debug("Режим перезаписи: текущее содержимое будет заменено")
+
+            logger.debug("Сохранение изменений страницы {}", title)
+            await self._save(page, new_content, "Обновление страницы ботом")
             logger.info(f"Обновлена страница: {title}")
             return True
 
         except Exception as e:
-            logger.error(f"Ошибка при редактировании страницы {title}: {str(e)}")
-            logger.error(f"Тип ошибки: {type(e).__name__}")
-            logger.error(f"Трассировка:\n{traceback.format_exc()}")
+            logger.exception(f"Ошибка при редактировании страницы {title}: {str(e)}")
             return False
 
     async def upload_file(self, title: str, file_path: str, description: str = "") -> bool:
         """Загрузка файла на MediaWiki"""
         try:
-            if not self.site:
+            if not self.api_url:
                 raise ValueError("Клиент MediaWiki не инициализирован")
 
             # Проверка существования файла
@@ -143,15 +374,24 @@ class WikiClient:
                 raise FileNotFoundError(f"Файл не найден: {file_path}")
 
             logger.info(f"Загрузка файла: {title}")
-            
+            file_size = file_path.stat().st_size
+
             # Открываем файл в бинарном режиме
             with open(file_path, 'rb') as file:
-                await asyncio.to_thread(
-                    self.site.upload,
-                    file,
-                    title,
-                    description
-                )
+                if file_size <= UPLOAD_CHUNK_SIZE:
+                    content = await self._run_blocking(file.read)
+                    result = await self._api_with_token(
+                        'upload',
+                        files={'file': (title, content)},
+                        filename=title,
+                        comment=description
+                    )
+                    upload = result.get('upload', {})
+                    if upload.get('result') != 'Success':
+                        logger.error(f"MediaWiki отклонила файл {title}: {upload}")
+                        return False
+                elif not await self._upload_chunked(file, file_size, title, description):
+                    return False
             
             logger.info(f"Загружен файл: {title}")
             return True
@@ -160,7 +400,128 @@ class WikiClient:
             logger.error(f"Файл не найден: {str(e)}")
             return False
         except Exception as e:
-            logger.error(f"Ошибка при загрузке файла {title}: {str(e)}")
-            logger.error(f"Тип ошибки: {type(e).__name__}")
-            logger.error(f"Трассировка:\n{traceback.format_exc()}")
-            return False 
\ No newline at end of file
+            logger.exception(f"Ошибка при загрузке файла {title}: {str(e)}")
+            return False
+
+    async def _upload_chunked(self, file, file_size: int, title: str, description: str) -> bool:
+        """Поблочная загрузка файла (stash=1): в памяти держится только текущий блок"""
+        offset = 0
+        filekey = None
+        while True:
+            chunk = await self._run_blocking(file.read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                logger.error(f"Файл {title} закончился раньше, чем MediaWiki приняла загрузку")
+                return False
+
+            result = await self._api_with_token(
+                'upload',
+                files={'chunk': (title, chunk)},
+                stash=1,
+                offset=offset,
+                filename=title,
+                filesize=file_size,
+                filekey=filekey
+            )
+            response = result.get('upload', {})
+            logger.debug("{}: загружено {} из {} байт", title, offset + len(chunk), file_size)
+            filekey = response.get('filekey')
+            if response.get('result') == 'Continue':
+                offset = response['offset']
+            elif response.get('result') == 'Success':
+                break
+            else:
+                logger.error(f"MediaWiki отклонила блок файла {title}: {response}")
+                return False
+
+        # Публикация файла из временного хранилища
+        result = await self._api_with_token('upload', filename=title, filekey=filekey, comment=description)
+        upload = result.get('upload', {})
+        if upload.get('result') != 'Success':
+            logger.error(f"MediaWiki отклонила файл {title}: {upload}")
+            return False
+        return True
+
+    async def close(self):
+        """Закрытие сессии и пула потоков"""
+        if self.session and self._owns_session:
+            await self.session.close()
+        self.session = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class WikiEditQueue:
+    """Очередь правок MediaWiki с пакетной параллельной отправкой"""
+
+    def __init__(self, wiki_client: WikiClient, batch_size: int = 8, max_wait: float = 0.1, maxsize: int = 200):
+        self.wiki_client = wiki_client
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запуск фонового обработчика очереди"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+            logger.info("Очередь правок MediaWiki запущена")
+
+    async def submit(self, title: str, content: str) -> bool:
+        """Постановка правки в очередь и ожидание результата"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((title, content, future))
+        return await future
+
+    async def _collect_batch(self, batch: list) -> list:
+        """Сбор пакета в batch: до batch_size правок или до истечения max_wait"""
+        batch.append(await self.queue.get())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        """Фоновая обработка очереди правок"""
+        while True:
+            batch: list = []
+            try:
+                await self._collect_batch(batch)
+                logger.info(f"Отправка пакета из {len(batch)} правок в MediaWiki")
+
+                try:
+                    results = await self.wiki_client.edit_pages([(title, content) for title, content, _ in batch])
+                    for (_, _, future), result in zip(batch, results):
+                        if not future.done():
+                            future.set_result(result)
+                except Exception as e:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+            finally:
+                # При отмене обработчика правки текущего пакета не должны зависнуть
+                for _, _, future in batch:
+                    if not future.done():
+                        future.cancel()
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def close(self):
+        """Остановка обработчика очереди"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        # Завершаем правки, которые так и не были отправлены
+        while not self.queue.empty():
+            _, _, future = self.queue.get_nowait()
+            if not future.done():
+                future.cancel()